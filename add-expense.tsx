@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useRef, useState } from 'react';
 import { View, Text, TextInput, TouchableOpacity, StyleSheet, Alert, KeyboardAvoidingView, Platform, ScrollView } from 'react-native';
 import { useRouter } from 'expo-router';
 import AsyncStorage from '@react-native-async-storage/async-storage';
@@ -22,6 +22,17 @@ export default function AddExpenseScreen() {
   const [isRecurring, setIsRecurring] = useState(false);
   const [recurrenceMonths, setRecurrenceMonths] = useState('');
   const [loading, setLoading] = useState(false);
+  // Key of the last submission that got no definitive answer. Resubmitting the same
+  // payload reuses it so the server creates the expense only once; any edit gets a new key.
+  const pendingSubmission = useRef<{ payload: string; key: string } | null>(null);
+
+  const idempotencyKeyFor = (payload: object) => {
+    const serialized = JSON.stringify(payload);
+    if (pendingSubmission.current?.payload !== serialized) {
+      pendingSubmission.current = { payload: serialized, key: `${Date.now()}-${Math.random().toString(36).slice(2)}` };
+    }
+    return pendingSubmission.current.key;
+  };
 
   const handleSubmit = async () => {
     if (!category || !amount) {
@@ -44,26 +55,29 @@ export default function AddExpenseScreen() {
     try {
       const token = await AsyncStorage.getItem('token');
       const today = new Date();
-      
-      await axios.post(
-        `${BACKEND_URL}/api/expenses`,
-        {
-          category,
-          location: location || null,
-          date: format(today, 'yyyy-MM-dd'),
-          amount: amountValue,
-          notes: notes || null,
-          is_recurring: isRecurring,
-          recurrence_months: isRecurring ? parseInt(recurrenceMonths) : null,
-        },
-        {
-          headers: { Authorization: `Bearer ${token}` }
-        }
-      );
+      const payload = {
+        category,
+        location: location || null,
+        date: format(today, 'yyyy-MM-dd'),
+        amount: amountValue,
+        notes: notes || null,
+        is_recurring: isRecurring,
+        recurrence_months: isRecurring ? parseInt(recurrenceMonths) : null,
+      };
+
+      await axios.post(`${BACKEND_URL}/api/expenses`, payload, {
+        headers: { Authorization: `Bearer ${token}`, 'Idempotency-Key': idempotencyKeyFor(payload) }
+      });
 
+      pendingSubmission.current = null;
       Alert.alert('Sucesso', 'Gasto adicionado com sucesso!');
       router.back();
     } catch (error: any) {
+      const status = error.response?.status;
+      // Only timeouts, load shedding and server errors may not have been applied; keep the key for those
+      if (status && status < 500 && status !== 409 && status !== 429) {
+        pendingSubmission.current = null;
+      }
       Alert.alert('Erro', error.response?.data?.detail || 'Erro ao adicionar gasto');
     } finally {
       setLoading(false);
@@ -0,0 +1,179 @@
+import asyncio
+import math
+import os
+import time
+import logging
+from collections import deque
+
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+# Route classes, each with its own concurrency budget.
+# auth: bcrypt hashing/checking is CPU bound and slow on purpose
+# heavy_read: aggregates and full-table listings
+AUTH_PATHS = {"/api/login", "/api/master-login", "/api/admin/users", "/api/admin/create-admin"}
+HEAVY_READ_PREFIXES = ("/api/statistics", "/api/audit-log", "/api/export", "/api/admin/users")
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+def classify_request(method: str, path: str) -> str:
+    if method == "POST" and path in AUTH_PATHS:
+        return "auth"
+    if method in WRITE_METHODS:
+        return "write"
+    if path.startswith(HEAVY_READ_PREFIXES):
+        return "heavy_read"
+    return "light_read"
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+class AdaptiveLimiter:
+    """Concurrency limit for one route class, adjusted with AIMD.
+
+    A fast completion of a request that was admitted while the limiter was
+    saturated (at or one below the limit, or after queueing) adds 1/limit
+    to the limit, about +1 per full window. Requests admitted with spare
+    capacity say nothing about whether more would be safe, so they never
+    grow it. A slow request multiplies the limit by `backoff`, at most once
+    per window.
+    """
+
+    def __init__(self, name: str, initial: float, min_limit: float, max_limit: float,
+                 target_latency: float, max_queue: int, queue_timeout: float, backoff: float = 0.9):
+        self.name = name
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.backoff = backoff
+        self.in_flight = 0
+        self.waiters = deque()
+        self.avg_latency = target_latency
+        self._last_decrease = 0.0
+        self._saturated_admissions = 0
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < max(1, int(self.limit))
+
+    def retry_after(self) -> int:
+        # Rough time until the current backlog drains
+        backlog = len(self.waiters) + self.in_flight
+        return max(1, math.ceil(self.avg_latency * backlog / max(1.0, self.limit)))
+
+    async def acquire(self) -> bool | None:
+        """Returns True when admitted, False when the queue is full, None on queue timeout."""
+        if self._has_capacity() and not self.waiters:
+            self.in_flight += 1
+            if self.in_flight >= int(self.limit) - 1:
+                self._saturated_admissions += 1
+            return True
+        if len(self.waiters) >= self.max_queue:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            return None
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter):
+        if waiter.done() and not waiter.cancelled():
+            # Admitted right as we gave up; hand the slot on
+            self.in_flight -= 1
+            self._wake_next()
+        else:
+            waiter.cancel()
+            self.waiters.remove(waiter)
+
+    def release(self, latency: float):
+        self.in_flight -= 1
+        self._adjust(latency)
+        self._wake_next()
+
+    def _wake_next(self):
+        while self.waiters and self._has_capacity():
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                self._saturated_admissions += 1
+                waiter.set_result(True)
+
+    def _adjust(self, latency: float):
+        self.avg_latency = 0.8 * self.avg_latency + 0.2 * latency
+        now = time.monotonic()
+        if latency > self.target_latency:
+            if now - self._last_decrease >= self.avg_latency:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+                logger.info(f"[Admission] {self.name} limit decreased to {self.limit:.1f}")
+        elif self._saturated_admissions:
+            self._saturated_admissions -= 1
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+
+def default_limiters() -> dict:
+    # Override any value with ADMISSION_<CLASS>_<SETTING>, e.g. ADMISSION_AUTH_MAX=8
+    defaults = {
+        "auth": dict(initial=4, min_limit=1, max_limit=8, target_latency=0.5, max_queue=16, queue_timeout=2.0),
+        "write": dict(initial=10, min_limit=2, max_limit=30, target_latency=0.3, max_queue=50, queue_timeout=3.0),
+        "heavy_read": dict(initial=4, min_limit=1, max_limit=10, target_latency=1.0, max_queue=10, queue_timeout=2.0),
+        "light_read": dict(initial=20, min_limit=4, max_limit=40, target_latency=0.2, max_queue=100, queue_timeout=1.0),
+    }
+    setting_env = {
+        "initial": "INITIAL", "min_limit": "MIN", "max_limit": "MAX",
+        "target_latency": "TARGET_LATENCY", "max_queue": "MAX_QUEUE", "queue_timeout": "QUEUE_TIMEOUT",
+    }
+    limiters = {}
+    for name, settings in defaults.items():
+        for key, suffix in setting_env.items():
+            value = _env_float(f"ADMISSION_{name.upper()}_{suffix}", settings[key])
+            settings[key] = int(value) if key == "max_queue" else value
+        limiters[name] = AdaptiveLimiter(name, **settings)
+    return limiters
+
+
+class AdmissionControlMiddleware:
+    """Sheds load per route class before requests reach the threadpool.
+
+    A full wait queue answers 429 immediately; a request that waits longer
+    than the class' queue timeout gets 503. Both carry Retry-After.
+    """
+
+    def __init__(self, app, limiters: dict = None):
+        self.app = app
+        self.limiters = limiters or default_limiters()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api"):
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiters[classify_request(scope["method"], scope["path"])]
+        admitted = await limiter.acquire()
+        if not admitted:
+            status_code = 429 if admitted is False else 503
+            response = JSONResponse(
+                status_code=status_code,
+                content={"detail": "Server busy, try again later"},
+                headers={"Retry-After": str(limiter.retry_after())},
+            )
+            await response(scope, receive, send)
+            return
+
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.monotonic() - start)
@@ -0,0 +1,369 @@
+"""Platform-wide analytics kept as mergeable sketches.
+
+The write path records into in-memory sketches; a background thread merges
+them into the analytics_sketches table (shard 0) every
+ANALYTICS_FLUSH_SECONDS. Because every sketch is mergeable, several worker
+processes can flush into the same rows. Each tick also reloads the stored
+rows, so a worker that only serves reports sees the others' data at most a
+tick late. Reads merge the persisted state with the unflushed local one, so
+/api/admin/analytics never scans expenses.
+
+Sketches only grow: deleted expenses are not subtracted.
+"""
+import atexit
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+from datetime import date, datetime, timedelta
+
+from database import SessionLocal
+from models import AnalyticsSketch
+
+ANALYTICS_FLUSH_SECONDS = float(os.environ.get("ANALYTICS_FLUSH_SECONDS", "60"))
+# Per-day sketches (active users, spend) older than this are dropped
+ANALYTICS_RETENTION_DAYS = int(os.environ.get("ANALYTICS_RETENTION_DAYS", "90"))
+
+DAU_PREFIX = "dau:"
+DAILY_SPEND_PREFIX = "spend:"
+DAILY_PREFIXES = (DAU_PREFIX, DAILY_SPEND_PREFIX)
+AMOUNTS_KEY = "amounts"
+CATEGORY_TOTALS_KEY = "category_totals"
+
+
+class HyperLogLog:
+    """Distinct count estimate, about 1.6% standard error with the default precision."""
+
+    def __init__(self, precision: int = 12, registers: bytes = None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers else bytearray(self.size)
+
+    def add(self, value):
+        digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+        hashed = int.from_bytes(digest, "big")
+        index = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size * self.size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = self.size * math.log(self.size / zeros)
+        return round(estimate)
+
+    def to_dict(self) -> dict:
+        return {"precision": self.precision, "registers": base64.b64encode(bytes(self.registers)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HyperLogLog":
+        return cls(data["precision"], base64.b64decode(data["registers"]))
+
+
+class TDigest:
+    """Merging t-digest for quantiles of a stream of amounts."""
+
+    def __init__(self, compression: float = 100, centroids: list = None, minimum: float = None, maximum: float = None):
+        self.compression = compression
+        self.centroids = centroids or []
+        self.buffer = []
+        self.min = minimum
+        self.max = maximum
+
+    @property
+    def total_weight(self) -> float:
+        return sum(weight for _, weight in self.centroids) + sum(weight for _, weight in self.buffer)
+
+    def add(self, value: float, weight: float = 1):
+        self.buffer.append((value, weight))
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self.buffer) >= self.compression * 5:
+            self.compress()
+
+    def merge(self, other: "TDigest"):
+        self.buffer.extend(other.centroids)
+        self.buffer.extend(other.buffer)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        self.compress()
+
+    def _scale(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _scale_inverse(self, k: float) -> float:
+        return (math.sin(min(k, self.compression / 4) * 2 * math.pi / self.compression) + 1) / 2
+
+    def compress(self):
+        points = sorted(self.centroids + self.buffer)
+        self.buffer = []
+        if not points:
+            return
+        total = sum(weight for _, weight in points)
+        merged = []
+        weight_so_far = 0.0
+        q_limit = self._scale_inverse(self._scale(0) + 1)
+        mean, weight = points[0]
+        for next_mean, next_weight in points[1:]:
+            if (weight_so_far + weight + next_weight) / total <= q_limit:
+                mean = (mean * weight + next_mean * next_weight) / (weight + next_weight)
+                weight += next_weight
+            else:
+                merged.append((mean, weight))
+                weight_so_far += weight
+                q_limit = self._scale_inverse(self._scale(weight_so_far / total) + 1)
+                mean, weight = next_mean, next_weight
+        merged.append((mean, weight))
+        self.centroids = merged
+
+    def quantile(self, q: float):
+        self.compress()
+        if not self.centroids:
+            return None
+        total = self.total_weight
+        target = q * total
+        cumulative = 0.0
+        previous_center, previous_value = 0.0, self.min
+        for mean, weight in self.centroids:
+            center = cumulative + weight / 2
+            if target < center:
+                span = center - previous_center
+                fraction = (target - previous_center) / span if span else 0
+                return previous_value + fraction * (mean - previous_value)
+            previous_center, previous_value = center, mean
+            cumulative += weight
+        span = total - previous_center
+        fraction = (target - previous_center) / span if span else 0
+        return previous_value + fraction * (self.max - previous_value)
+
+    def to_dict(self) -> dict:
+        self.compress()
+        return {"compression": self.compression, "centroids": self.centroids, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TDigest":
+        centroids = [tuple(centroid) for centroid in data["centroids"]]
+        return cls(data["compression"], centroids, data["min"], data["max"])
+
+
+class Totals:
+    """Sum and count per key; merging just adds."""
+
+    def __init__(self, values: dict = None):
+        self.values = values or {}
+
+    def add(self, key: str, amount: float, count: int = 1):
+        total, current_count = self.values.get(key, (0.0, 0))
+        self.values[key] = (total + amount, current_count + count)
+
+    def merge(self, other: "Totals"):
+        for key, (amount, count) in other.values.items():
+            self.add(key, amount, count)
+
+    def to_dict(self) -> dict:
+        return {"values": {key: list(value) for key, value in self.values.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Totals":
+        return cls({key: tuple(value) for key, value in data["values"].items()})
+
+
+def sketch_class(key: str):
+    if key.startswith(DAU_PREFIX):
+        return HyperLogLog
+    if key == AMOUNTS_KEY:
+        return TDigest
+    return Totals
+
+
+class PlatformAnalytics:
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self.lock = threading.Lock()
+        # Serialises flush and refresh so a batch is dropped only by the refresh that read it back
+        self.flush_lock = threading.RLock()
+        self.pending = {}
+        # Swapped out of pending but not yet part of persisted; still counted by snapshot()
+        self.flushing = {}
+        self.persisted = None
+        self.updated_at = None
+        self._flusher = None
+
+    def _sketch(self, sketches: dict, key: str):
+        if key not in sketches:
+            sketches[key] = sketch_class(key)()
+        return sketches[key]
+
+    def record_activity(self, user_id: int, day: date = None):
+        day = day or date.today()
+        with self.lock:
+            self._sketch(self.pending, DAU_PREFIX + day.isoformat()).add(user_id)
+        self._start_flusher()
+
+    def record_expenses(self, expenses: list):
+        """`expenses` is a list of (category, date string, amount)."""
+        with self.lock:
+            amounts = self._sketch(self.pending, AMOUNTS_KEY)
+            categories = self._sketch(self.pending, CATEGORY_TOTALS_KEY)
+            for category, expense_date, amount in expenses:
+                amounts.add(amount)
+                categories.add(category, amount)
+                self._sketch(self.pending, DAILY_SPEND_PREFIX + expense_date[:10]).add(category, amount)
+        self._start_flusher()
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+        with self.lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="analytics-flush", daemon=True)
+            self._flusher.start()
+            atexit.register(self.flush)
+
+    def _flush_loop(self):
+        stop = threading.Event()
+        while not stop.wait(ANALYTICS_FLUSH_SECONDS):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"[Analytics] Flush failed: {e}")
+
+    def _load(self, db, keys=None) -> dict:
+        query = db.query(AnalyticsSketch)
+        if keys is not None:
+            query = query.filter(AnalyticsSketch.key.in_(keys)).with_for_update()
+        return {row.key: row for row in query}
+
+    def flush(self):
+        """Merges the pending sketches into the stored ones and reloads the stored view."""
+        with self.flush_lock:
+            if self.flushing:
+                # The last flush was written but its refresh failed
+                self.refresh()
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                self.flushing = pending
+            if pending:
+                self._write(pending)
+            # Other processes flush into the same rows, so refresh the whole view
+            self.refresh()
+
+    def _write(self, pending: dict):
+        oldest_day = (date.today() - timedelta(days=ANALYTICS_RETENTION_DAYS)).isoformat()
+        db = self.session_factory()
+        try:
+            rows = self._load(db, list(pending))
+            for key, sketch in pending.items():
+                row = rows.get(key)
+                if row is None:
+                    row = AnalyticsSketch(key=key)
+                    db.add(row)
+                else:
+                    stored = sketch_class(key).from_dict(json.loads(row.data))
+                    stored.merge(sketch)
+                    sketch = stored
+                row.data = json.dumps(sketch.to_dict())
+                row.updated_at = datetime.utcnow()
+            for prefix in DAILY_PREFIXES:
+                db.query(AnalyticsSketch).filter(
+                    AnalyticsSketch.key.like(prefix + "%"),
+                    AnalyticsSketch.key < prefix + oldest_day
+                ).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            # Keep the data for the next attempt
+            with self.lock:
+                for key, sketch in pending.items():
+                    self._sketch(self.pending, key).merge(sketch)
+                self.flushing = {}
+            raise
+        finally:
+            db.close()
+
+    def _read_persisted(self) -> dict:
+        db = self.session_factory()
+        try:
+            return {key: sketch_class(key).from_dict(json.loads(row.data)) for key, row in self._load(db).items()}
+        finally:
+            db.close()
+
+    def refresh(self):
+        with self.flush_lock:
+            persisted = self._read_persisted()
+            with self.lock:
+                # Whatever was being flushed is committed, so it is part of what was just read
+                self.persisted = persisted
+                self.flushing = {}
+                self.updated_at = datetime.utcnow()
+
+    def snapshot(self, keys: list) -> dict:
+        """Persisted sketches merged with this process' unflushed ones."""
+        self._start_flusher()
+        if self.updated_at is None or datetime.utcnow() - self.updated_at > timedelta(seconds=ANALYTICS_FLUSH_SECONDS):
+            # Normally kept fresh by the flusher; covers the first read and a stalled loop
+            self.refresh()
+        with self.lock:
+            merged = {}
+            for sketches in (self.persisted, self.flushing, self.pending):
+                for key in keys:
+                    sketch = sketches.get(key)
+                    if sketch is None:
+                        continue
+                    self._sketch(merged, key).merge(sketch_class(key).from_dict(sketch.to_dict()))
+        return merged
+
+    def report(self, days: int = 30) -> dict:
+        today = date.today()
+        window = [(today - timedelta(days=offset)).isoformat() for offset in range(days - 1, -1, -1)]
+        sketches = self.snapshot(
+            [DAU_PREFIX + day for day in window] + [DAILY_SPEND_PREFIX + day for day in window] + [AMOUNTS_KEY, CATEGORY_TOTALS_KEY]
+        )
+
+        period_users = HyperLogLog()
+        daily_active_users = []
+        daily_spend = []
+        for day in window:
+            sketch = sketches.get(DAU_PREFIX + day)
+            daily_active_users.append({"date": day, "users": sketch.count() if sketch else 0})
+            if sketch:
+                period_users.merge(sketch)
+            spend = sketches.get(DAILY_SPEND_PREFIX + day, Totals()).values.values()
+            daily_spend.append({"date": day, "total": sum(total for total, _ in spend), "count": sum(count for _, count in spend)})
+
+        category_totals = sketches.get(CATEGORY_TOTALS_KEY, Totals())
+        amounts = sketches.get(AMOUNTS_KEY, TDigest())
+
+        return {
+            "daily_active_users": daily_active_users,
+            "active_users_in_period": period_users.count(),
+            "spend_by_category": sorted(
+                [{"category": category, "_id": category, "total": total, "count": count}
+                 for category, (total, count) in category_totals.values.items()],
+                key=lambda item: item["total"], reverse=True
+            ),
+            "daily_spend": daily_spend,
+            "amount_distribution": {
+                "count": int(amounts.total_weight),
+                "min": amounts.min,
+                "max": amounts.max,
+                "percentiles": {f"p{round(q * 100)}": amounts.quantile(q) for q in (0.25, 0.5, 0.75, 0.9, 0.95, 0.99)},
+            },
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+
+platform_analytics = PlatformAnalytics(SessionLocal)
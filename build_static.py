@@ -0,0 +1,85 @@
+"""Build the static frontend for production.
+
+    python build_static.py
+
+Copies static/ into static_build/ with content-hashed filenames
+(app.js -> app.3f2a91c0.js), rewrites /static/ references to the hashed
+names, and writes .gz (and .br when the optional `brotli` package is
+installed) next to every compressible file. HTML files keep their names
+since they are the entry points. Every hashed file is also written under
+its original name, so references the build cannot rewrite (paths built in
+JS, the mobile app, external links) keep working with revalidation.
+"""
+import gzip
+import hashlib
+import json
+import re
+import shutil
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from static_assets import STATIC_DIR, STATIC_BUILD_DIR, MANIFEST_NAME, COMPRESSIBLE_SUFFIXES
+
+# Text assets may reference other assets, so they are hashed after what they point to
+TEXT_ORDER = {".css": 1, ".js": 2, ".mjs": 2, ".html": 3}
+MIN_COMPRESS_SIZE = 256
+
+
+def fingerprint(name: str, content: bytes) -> str:
+    digest = hashlib.sha256(content).hexdigest()[:8]
+    stem, dot, suffix = name.rpartition(".")
+    return f"{stem}.{digest}.{suffix}" if dot else f"{name}.{digest}"
+
+
+def rewrite_references(content: bytes, manifest: dict) -> bytes:
+    if not manifest:
+        return content
+    pattern = re.compile("/static/(" + "|".join(re.escape(name) for name in sorted(manifest, key=len, reverse=True)) + r")(?![\w.-])")
+    text = content.decode("utf-8")
+    return pattern.sub(lambda match: "/static/" + manifest[match.group(1)], text).encode("utf-8")
+
+
+def write_compressed_variants(path: Path):
+    content = path.read_bytes()
+    if path.suffix not in COMPRESSIBLE_SUFFIXES or len(content) < MIN_COMPRESS_SIZE:
+        return
+    # mtime=0 keeps the output reproducible across builds
+    path.with_name(path.name + ".gz").write_bytes(gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        path.with_name(path.name + ".br").write_bytes(brotli.compress(content, quality=11))
+
+
+def build(source: Path, target: Path):
+    if target.exists():
+        shutil.rmtree(target)
+    target.mkdir(parents=True)
+
+    files = [path for path in source.rglob("*") if path.is_file()]
+    files.sort(key=lambda path: (TEXT_ORDER.get(path.suffix, 0), str(path)))
+
+    manifest = {}
+    for path in files:
+        name = path.relative_to(source).as_posix()
+        content = path.read_bytes()
+        if path.suffix in TEXT_ORDER:
+            content = rewrite_references(content, manifest)
+        output_name = name if path.suffix == ".html" else fingerprint(name, content)
+        for written_name in {name, output_name}:
+            output = target / written_name
+            output.parent.mkdir(parents=True, exist_ok=True)
+            output.write_bytes(content)
+            write_compressed_variants(output)
+        if output_name != name:
+            manifest[name] = output_name
+
+    (target / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    print(f"[Static] Built {len(files)} files into {target} (brotli: {'yes' if brotli else 'no'})")
+
+
+if __name__ == "__main__":
+    root = Path(__file__).parent
+    build(root / STATIC_DIR, root / STATIC_BUILD_DIR)
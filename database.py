@@ -1,7 +1,12 @@
 import os
-from sqlalchemy import create_engine
+import time
+import random
+import logging
+import threading
+from sqlalchemy import create_engine, event, text, inspect, MetaData
+from sqlalchemy.schema import CreateTable, CreateIndex
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,18 +19,247 @@ if not DATABASE_URL or "neon" in DATABASE_URL:
 
 print(f"[DB] Using database: {DATABASE_URL}")
 
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-else:
-    engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=300)
+# Optional read replicas, comma separated. A copied SQLite file works as a local stand-in:
+#   cp escala.db escala-replica.db
+#   READ_REPLICA_URLS=sqlite:///./escala-replica.db
+READ_REPLICA_URLS = [url.strip() for url in os.environ.get("READ_REPLICA_URLS", "").split(",") if url.strip()]
+# Seconds a principal keeps reading from the primary after it writes. Tracked in
+# process memory, so with several workers a read served by another worker than
+# the write can still hit a replica within this window.
+REPLICA_STICKY_SECONDS = float(os.environ.get("REPLICA_STICKY_SECONDS", "5"))
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", "10"))
+REPLICA_CHECK_INTERVAL = float(os.environ.get("REPLICA_CHECK_INTERVAL", "15"))
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get("REPLICA_CONNECT_TIMEOUT", "3"))
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+def make_engine(url: str, connect_timeout: int = None):
+    if url.startswith("sqlite"):
+        sqlite_engine = create_engine(url, connect_args={"check_same_thread": False})
+        # SQLite ignores ON DELETE CASCADE unless foreign keys are enabled per connection
+        event.listen(sqlite_engine, "connect", _enable_sqlite_foreign_keys)
+        return sqlite_engine
+    connect_args = {"connect_timeout": connect_timeout} if connect_timeout else {}
+    return create_engine(url, pool_pre_ping=True, pool_recycle=300, connect_args=connect_args)
+
+engine = make_engine(DATABASE_URL)
+
+# Optional extra shards for user data, comma separated. Shard 0 is always DATABASE_URL,
+# which also holds the shard directory, master users and admin audit entries.
+SHARD_URLS = [url.strip() for url in os.environ.get("SHARD_URLS", "").split(",") if url.strip()]
+shard_engines = [engine] + [make_engine(url) for url in SHARD_URLS]
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        # A dead replica must fail fast instead of hanging for the TCP timeout
+        self.engine = make_engine(url, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+        # Unused until the first health check passes
+        self.healthy = False
+
+    def check(self):
+        try:
+            with self.engine.connect() as conn:
+                if self.engine.dialect.name == "postgresql":
+                    # NULL when not in recovery or fully caught up with what it received
+                    lag = conn.execute(text(
+                        "SELECT CASE WHEN pg_is_in_recovery() "
+                        "AND pg_last_wal_receive_lsn() <> pg_last_wal_replay_lsn() "
+                        "THEN EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+                    )).scalar()
+                    has_schema = True
+                else:
+                    has_schema = conn.execute(text("SELECT 1 FROM sqlite_master LIMIT 1")).first() is not None
+                    lag = None
+            healthy = has_schema and (lag is None or float(lag) <= REPLICA_MAX_LAG_SECONDS)
+            if lag is not None and not healthy:
+                logging.warning(f"[DB] Replica {self.engine.url!r} lagging {float(lag):.1f}s - using primary")
+        except Exception as e:
+            logging.warning(f"[DB] Replica {self.engine.url!r} unavailable: {e}")
+            healthy = False
+        self.healthy = healthy
+
+replicas = [Replica(url) for url in READ_REPLICA_URLS]
+
+def _check_replicas_loop():
+    # Health checks run here so request threads never wait on replica I/O
+    while True:
+        for replica in replicas:
+            replica.check()
+        time.sleep(REPLICA_CHECK_INTERVAL)
+
+if replicas:
+    threading.Thread(target=_check_replicas_loop, name="replica-health", daemon=True).start()
+
+_last_write_lock = threading.Lock()
+_last_write_at = {}
+_last_write_pruned = time.monotonic()
+
+def record_write(principal: str):
+    global _last_write_pruned
+    now = time.monotonic()
+    with _last_write_lock:
+        _last_write_at[principal] = now
+        # Drop expired entries so principals that never read again do not accumulate
+        if now - _last_write_pruned >= REPLICA_STICKY_SECONDS:
+            for expired in [key for key, written_at in _last_write_at.items() if now - written_at > REPLICA_STICKY_SECONDS]:
+                del _last_write_at[expired]
+            _last_write_pruned = now
+
+def recently_wrote(principal: str) -> bool:
+    written_at = _last_write_at.get(principal)
+    if written_at is None:
+        return False
+    return time.monotonic() - written_at <= REPLICA_STICKY_SECONDS
+
+def pick_replica():
+    """Returns a healthy replica engine, or None to fall back to the primary."""
+    healthy = [replica for replica in replicas if replica.healthy]
+    if not healthy:
+        return None
+    return random.choice(healthy).engine
+
+class RoutingSession(Session):
+    """Reads go to `info["replica"]` when set; flushes and writes always use the primary."""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = self.info.get("replica")
+        if replica is not None and not self._flushing and not self.info.get("wrote"):
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+@event.listens_for(RoutingSession, "after_flush")
+def _mark_session_wrote(session, flush_context):
+    session.info["wrote"] = True
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _mark_session_bulk_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+@event.listens_for(RoutingSession, "after_commit")
+def _record_principal_write(session):
+    principal = session.info.get("principal")
+    if principal and session.info.get("wrote"):
+        record_write(principal)
+
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+def migrate_cascade_foreign_keys(bind):
+    """Upgrades foreign keys created before they declared ON DELETE CASCADE.
+
+    create_all never alters existing tables, and with foreign keys enforced
+    the old constraints make deleting a user with data fail. Postgres gets
+    its constraints replaced; SQLite cannot alter constraints, so affected
+    tables are rebuilt and their rows copied over.
+    """
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    outdated = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        cascading = {fk.parent.name: fk for fk in table.foreign_keys if (fk.ondelete or "").upper() == "CASCADE"}
+        for reflected in inspector.get_foreign_keys(table.name):
+            columns = reflected["constrained_columns"]
+            if len(columns) == 1 and columns[0] in cascading and (reflected["options"].get("ondelete") or "").upper() != "CASCADE":
+                outdated.append((table, cascading[columns[0]], reflected))
+    if not outdated:
+        return
+
+    if bind.dialect.name == "sqlite":
+        _rebuild_sqlite_tables(bind, [table for table, _, _ in outdated])
+    else:
+        with bind.begin() as conn:
+            for table, fk, reflected in outdated:
+                name = reflected["name"]
+                referred = fk.column
+                conn.execute(text(f'ALTER TABLE {table.name} DROP CONSTRAINT "{name}"'))
+                conn.execute(text(
+                    f'ALTER TABLE {table.name} ADD CONSTRAINT "{name}" FOREIGN KEY ({fk.parent.name}) '
+                    f'REFERENCES {referred.table.name} ({referred.name}) ON DELETE CASCADE'
+                ))
+    logging.info(f"[DB] Added ON DELETE CASCADE to: {', '.join(sorted({table.name for table, _, _ in outdated}))}")
+
+def create_missing_indexes(bind):
+    """Creates model indexes that existing tables do not have yet (create_all skips existing tables)."""
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+                    created.append(index.name)
+    if created:
+        logging.info(f"[DB] Created indexes: {', '.join(created)}")
+
+def _rebuild_sqlite_tables(bind, tables):
+    # The documented SQLite procedure: foreign keys off, build the new table, copy, swap, check
+    raw = bind.raw_connection()
+    connection = raw.driver_connection
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None
+    cursor = connection.cursor()
+    try:
+        cursor.execute("PRAGMA foreign_keys=OFF")
+        cursor.execute("BEGIN")
+        for table in tables:
+            metadata = MetaData()
+            for referred in {fk.column.table for fk in table.foreign_keys}:
+                referred.to_metadata(metadata)
+            new_table = table.to_metadata(metadata, name=f"{table.name}__new")
+            cursor.execute(str(CreateTable(new_table).compile(dialect=bind.dialect)))
+
+            old_columns = {column[1] for column in cursor.execute(f"PRAGMA table_info({table.name})").fetchall()}
+            columns = ", ".join(column.name for column in table.columns if column.name in old_columns)
+            # Rows whose user is already gone could never be read again and would fail the new constraint
+            orphan_filter = " AND ".join(
+                f"{fk.parent.name} IN (SELECT {fk.column.name} FROM {fk.column.table.name})" for fk in table.foreign_keys
+            )
+            cursor.execute(f"INSERT INTO {table.name}__new ({columns}) SELECT {columns} FROM {table.name} WHERE {orphan_filter}")
+            cursor.execute(f"DROP TABLE {table.name}")
+            cursor.execute(f"ALTER TABLE {table.name}__new RENAME TO {table.name}")
+            for index in table.indexes:
+                cursor.execute(str(CreateIndex(index, if_not_exists=True).compile(dialect=bind.dialect)))
+        if cursor.execute("PRAGMA foreign_key_check").fetchall():
+            raise RuntimeError("Foreign key check failed after rebuilding tables")
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    finally:
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+        connection.isolation_level = isolation_level
+        raw.close()
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+def get_routed_db(principal: str, read_only: bool = False, shard_id: int = 0):
+    """Session for one authenticated request.
+
+    Read-only requests on shard 0 go to a healthy replica unless the principal
+    wrote within the last REPLICA_STICKY_SECONDS (read-your-writes).
+    """
+    db = SessionLocal(bind=shard_engines[shard_id], info={"principal": principal})
+    if read_only and shard_id == 0 and not recently_wrote(principal):
+        db.info["replica"] = pick_replica()
+    try:
+        yield db
+    finally:
+        db.close()
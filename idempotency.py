@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+from fastapi.responses import JSONResponse
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", "10000"))
+# How long a duplicate waits for the original request before giving up
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", "30"))
+
+
+class IdempotencyEntry:
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.done = asyncio.Event()
+        self.response = None
+        self.expires_at = time.monotonic() + IDEMPOTENCY_TTL_SECONDS
+
+
+class IdempotencyStore:
+    """In-memory LRU of idempotency keys with a TTL.
+
+    Lives in the process, so replays are only recognised by the worker
+    that served the original request.
+    """
+
+    def __init__(self, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.max_keys = max_keys
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def start(self, key, fingerprint: str) -> IdempotencyEntry:
+        entry = IdempotencyEntry(fingerprint)
+        self.entries[key] = entry
+        # Evict the least recently used finished entries; running requests are never evicted
+        excess = len(self.entries) - self.max_keys
+        victims = []
+        for old_key, old_entry in self.entries.items():
+            if len(victims) >= excess:
+                break
+            if old_entry.done.is_set():
+                victims.append(old_key)
+        for old_key in victims:
+            del self.entries[old_key]
+        return entry
+
+    def discard(self, key, entry: IdempotencyEntry):
+        if self.entries.get(key) is entry:
+            del self.entries[key]
+        entry.done.set()
+
+
+class IdempotencyMiddleware:
+    """Replays the stored response for POSTs retried with the same Idempotency-Key.
+
+    Keys are scoped per principal (resolved from the Authorization header)
+    and path. A duplicate that arrives while the original is still running
+    waits for it instead of executing twice. Reusing a key with a different
+    body is rejected with 422. Load-shed and server error responses are not
+    stored so the client can retry them.
+    """
+
+    def __init__(self, app, resolve_principal, store: IdempotencyStore = None):
+        self.app = app
+        self.resolve_principal = resolve_principal
+        self.store = store or IdempotencyStore()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        idempotency_key = headers.get(IDEMPOTENCY_HEADER)
+        principal = self.resolve_principal(headers.get(b"authorization", b"").decode("latin-1")) if idempotency_key else None
+        if principal is None:
+            await self.app(scope, receive, send)
+            return
+
+        body = await read_body(receive)
+        fingerprint = hashlib.sha256(body).hexdigest()
+        key = (principal, scope["path"], idempotency_key)
+
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            entry = self.store.get(key)
+            if entry is None:
+                break
+            if entry.fingerprint != fingerprint:
+                await error_response(422, "Idempotency-Key reused with a different request body")(scope, receive, send)
+                return
+            if entry.done.is_set():
+                await replay(entry.response, send)
+                return
+            try:
+                await asyncio.wait_for(entry.done.wait(), timeout=max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                await error_response(409, "A request with this Idempotency-Key is still in progress")(scope, receive, send)
+                return
+            # Either finished (replay on next pass) or failed and was discarded (execute it ourselves)
+
+        entry = self.store.start(key, fingerprint)
+        status, response_headers, chunks = None, [], []
+
+        body_sent = False
+
+        async def receive_body():
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def capture_send(message):
+            nonlocal status, response_headers
+            if message["type"] == "http.response.start":
+                status, response_headers = message["status"], list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_body, capture_send)
+        except BaseException:
+            self.store.discard(key, entry)
+            raise
+
+        # Shed (429) and failed requests were not executed to completion; let the retry run them
+        if status is None or status == 429 or status >= 500:
+            self.store.discard(key, entry)
+            return
+        entry.response = (status, response_headers, b"".join(chunks))
+        entry.done.set()
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def replay(response, send):
+    status, headers, body = response
+    await send({"type": "http.response.start", "status": status, "headers": headers + [(b"idempotent-replayed", b"true")]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def error_response(status_code: int, detail: str):
+    return JSONResponse(status_code=status_code, content={"detail": detail})
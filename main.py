@@ -1,8 +1,8 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, or_
 from dotenv import load_dotenv
 from pathlib import Path
 from pydantic import BaseModel
@@ -12,14 +12,23 @@ import bcrypt
 import jwt
 import os
 import logging
+import heapq
 
-from database import engine, get_db, Base
-from models import User, MasterUser, Expense, Income, Debt, CreditCard, Gamification, AuditLog
-from fastapi.staticfiles import StaticFiles
+from database import shard_engines, get_db, get_routed_db, migrate_cascade_foreign_keys, create_missing_indexes, Base
+from models import User, MasterUser, Expense, Income, Debt, CreditCard, Gamification, AuditLog, ShardAssignment
+from sharding import shard_directory, shard_session, fan_out
+from analytics import platform_analytics, ANALYTICS_RETENTION_DAYS
+from admission import AdmissionControlMiddleware
+from idempotency import IdempotencyMiddleware
+from static_assets import PrecompressedStaticFiles, CachedIndex, ApiGZipMiddleware, static_directory
 
 # Create tables with error handling
 try:
-    Base.metadata.create_all(bind=engine)
+    for shard_engine in shard_engines:
+        Base.metadata.create_all(bind=shard_engine)
+        migrate_cascade_foreign_keys(shard_engine)
+        create_missing_indexes(shard_engine)
+    shard_directory.backfill()
     logging.info("Database tables created successfully")
 except Exception as e:
     logging.error(f"Error creating database tables: {e}")
@@ -35,8 +44,10 @@ JWT_ALGORITHM = 'HS256'
 # Create the main app
 app = FastAPI(title="Financial Control API")
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Mount static files (the fingerprinted, precompressed build from build_static.py when present)
+STATIC_ROOT = static_directory()
+app.mount("/static", PrecompressedStaticFiles(directory=STATIC_ROOT), name="static")
+frontend_index = CachedIndex(os.path.join(STATIC_ROOT, "index.html"))
 security = HTTPBearer()
 
 # Pydantic Models
@@ -73,6 +84,9 @@ class ExpenseCreate(BaseModel):
     is_recurring: bool = False
     recurrence_months: Optional[int] = None
 
+class ExpenseBulkDelete(BaseModel):
+    ids: List[int]
+
 class IncomeCreate(BaseModel):
     income_type: str
     amount: float
@@ -147,11 +161,35 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     except:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
-# Routes
-@app.get("/")
-def root():
-    return {"message": "Financial Control API"}
+def principal_from_authorization(authorization: str):
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return get_principal(jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM]))
+    except Exception:
+        return None
+
+# Database sessions scoped to the authenticated principal
+def get_principal(payload: dict):
+    return f"{payload['user_type']}:{payload['user_id']}"
+
+# Primary users are routed to the shard holding their data; admins work on shard 0
+def get_shard_id(payload: dict, write: bool):
+    if payload['user_type'] != 'primary':
+        return 0
+    shard_id, moving = shard_directory.locate(int(payload['user_id']))
+    if moving and write:
+        raise HTTPException(status_code=503, detail="Account is being migrated, try again shortly", headers={"Retry-After": "10"})
+    return shard_id
+
+def get_write_db(payload: dict = Depends(verify_token)):
+    yield from get_routed_db(get_principal(payload), shard_id=get_shard_id(payload, write=True))
 
+def get_read_db(payload: dict = Depends(verify_token)):
+    yield from get_routed_db(get_principal(payload), read_only=True, shard_id=get_shard_id(payload, write=False))
+
+# Routes
 @app.get("/api/")
 def api_root():
     return {"message": "Financial Control API"}
@@ -159,13 +197,20 @@ def api_root():
 # Primary Login
 @app.post("/api/login")
 def login(user_login: UserLogin, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == user_login.username).first()
+    # Users missing from the directory (created outside the API) live on shard 0
+    assignment = shard_directory.find_username(db, user_login.username)
+    if assignment:
+        with shard_session(assignment.shard_id) as shard_db:
+            user = shard_db.query(User).filter(User.id == assignment.id).first()
+    else:
+        user = db.query(User).filter(User.username == user_login.username).first()
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if not bcrypt.checkpw(user_login.password.encode('utf-8'), user.password_hash.encode('utf-8')):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    platform_analytics.record_activity(user.id)
     token = create_token(user.id, user.username, 'primary')
     return {
         "token": token,
@@ -194,7 +239,7 @@ def master_login(master_login: MasterLogin, db: Session = Depends(get_db)):
 
 # Profile Management
 @app.post("/api/profile")
-def update_profile(profile: UserProfile, payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def update_profile(profile: UserProfile, payload: dict = Depends(verify_token), db: Session = Depends(get_write_db)):
     if payload['user_type'] != 'primary':
         raise HTTPException(status_code=403, detail="Only primary users can update profile")
     
@@ -202,6 +247,13 @@ def update_profile(profile: UserProfile, payload: dict = Depends(verify_token),
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
+    if profile.family_id != user.family_id:
+        # Families stay on one shard; joining one elsewhere needs `python sharding.py move` first
+        try:
+            shard_directory.change_family(user.id, profile.family_id)
+        except ValueError:
+            raise HTTPException(status_code=409, detail="Family is stored on another shard; move the user first")
+    
     user.full_name = profile.full_name
     user.cpf = profile.cpf
     user.address = profile.address
@@ -214,7 +266,7 @@ def update_profile(profile: UserProfile, payload: dict = Depends(verify_token),
     return {"message": "Profile updated successfully"}
 
 @app.get("/api/profile")
-def get_profile(payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def get_profile(payload: dict = Depends(verify_token), db: Session = Depends(get_read_db)):
     if payload['user_type'] != 'primary':
         raise HTTPException(status_code=403, detail="Only primary users can view profile")
     
@@ -236,16 +288,23 @@ def get_profile(payload: dict = Depends(verify_token), db: Session = Depends(get
 
 # Admin - User Management
 @app.post("/api/admin/users")
-def create_user(user: UserCreate, payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def create_user(user: UserCreate, payload: dict = Depends(verify_token), db: Session = Depends(get_write_db)):
     if payload['user_type'] not in ['master', 'admin']:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
-    existing = db.query(User).filter(User.username == user.username).first()
+    # Users created before the directory existed may not be registered in it yet
+    existing = shard_directory.find_username(db, user.username) or db.query(User).filter(User.username == user.username).first()
     if existing:
         raise HTTPException(status_code=400, detail="Username already exists")
     
     hashed_password = bcrypt.hashpw(user.password.encode('utf-8'), bcrypt.gensalt())
+    
+    # Reserve the id and shard in the directory first, then create the user on its shard
+    assignment = shard_directory.assign(db, user.username, user.family_id)
+    db.commit()
+    new_user_id = assignment.id
     new_user = User(
+        id=new_user_id,
         username=user.username,
         password_hash=hashed_password.decode('utf-8'),
         full_name=user.full_name,
@@ -257,50 +316,66 @@ def create_user(user: UserCreate, payload: dict = Depends(verify_token), db: Ses
         notes=user.notes
     )
     
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    try:
+        with shard_session(assignment.shard_id) as shard_db:
+            shard_db.add(new_user)
+            shard_db.commit()
+    except Exception:
+        db.delete(assignment)
+        db.commit()
+        raise
     
     # Log action
     audit = AuditLog(
         user_id=int(payload['user_id']),
         action="create_user",
         item_type="user",
-        item_id=str(new_user.id),
+        item_id=str(new_user_id),
         details=f"Created user: {user.username}"
     )
     db.add(audit)
     db.commit()
     
-    return {"message": "User created successfully", "user_id": str(new_user.id)}
+    return {"message": "User created successfully", "user_id": str(new_user_id)}
 
 @app.get("/api/admin/users")
-def list_users(payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def list_users(payload: dict = Depends(verify_token), db: Session = Depends(get_read_db)):
     if payload['user_type'] not in ['master', 'admin']:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
-    users = db.query(User).all()
-    return [{
-        "id": user.id,
-        "_id": str(user.id),
-        "username": user.username,
-        "full_name": user.full_name,
-        "cpf": user.cpf,
-        "address": user.address,
-        "family_id": user.family_id
-    } for user in users]
+    # Query every shard in parallel and merge
+    def shard_users(shard_id: int, shard_db: Session):
+        return [{
+            "id": user.id,
+            "_id": str(user.id),
+            "username": user.username,
+            "full_name": user.full_name,
+            "cpf": user.cpf,
+            "address": user.address,
+            "family_id": user.family_id
+        } for user in shard_db.query(User).all()]
+    
+    return sorted((user for users in fan_out(shard_users, shard0_db=db) for user in users), key=lambda user: user["id"])
 
 @app.delete("/api/admin/users/{user_id}")
-def delete_user(user_id: int, payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def delete_user(user_id: int, payload: dict = Depends(verify_token), db: Session = Depends(get_write_db)):
     if payload['user_type'] not in ['master', 'admin']:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+    shard_id, moving = shard_directory.locate(user_id)
+    if moving:
+        raise HTTPException(status_code=503, detail="User is being migrated, try again shortly", headers={"Retry-After": "10"})
+    
+    # Single DELETE; expenses, income, debts, cards and gamification go with it via ON DELETE CASCADE
+    with shard_session(shard_id) as shard_db:
+        deleted = shard_db.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+        shard_db.commit()
+    if not deleted:
         raise HTTPException(status_code=404, detail="User not found")
     
-    db.delete(user)
+    db.query(ShardAssignment).filter(ShardAssignment.id == user_id).delete(synchronize_session=False)
     db.commit()
+    shard_directory.forget(user_id)
     
     # Log action
     audit = AuditLog(
@@ -316,7 +391,7 @@ def delete_user(user_id: int, payload: dict = Depends(verify_token), db: Session
     return {"message": "User deleted successfully"}
 
 @app.post("/api/admin/create-admin")
-def create_admin(admin: AdminUserCreate, payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def create_admin(admin: AdminUserCreate, payload: dict = Depends(verify_token), db: Session = Depends(get_write_db)):
     if payload['user_type'] != 'master':
         raise HTTPException(status_code=403, detail="Only master can create admins")
     
@@ -339,7 +414,7 @@ def create_admin(admin: AdminUserCreate, payload: dict = Depends(verify_token),
 
 # Expenses
 @app.post("/api/expenses")
-def create_expense(expense: ExpenseCreate, payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def create_expense(expense: ExpenseCreate, payload: dict = Depends(verify_token), db: Session = Depends(get_write_db)):
     if payload['user_type'] != 'primary':
         raise HTTPException(status_code=403, detail="Unauthorized")
     
@@ -358,6 +433,8 @@ def create_expense(expense: ExpenseCreate, payload: dict = Depends(verify_token)
     db.commit()
     db.refresh(new_expense)
     
+    recorded = [(expense.category, expense.date, expense.amount)]
+    
     # If recurring, create additional entries
     if expense.is_recurring and expense.recurrence_months:
         from dateutil.relativedelta import relativedelta
@@ -376,6 +453,7 @@ def create_expense(expense: ExpenseCreate, payload: dict = Depends(verify_token)
                 parent_expense_id=new_expense.id
             )
             db.add(recurring_expense)
+            recorded.append((expense.category, recurring_expense.date, expense.amount))
         
         db.commit()
     
@@ -393,22 +471,30 @@ def create_expense(expense: ExpenseCreate, payload: dict = Depends(verify_token)
     # Update gamification
     update_gamification(int(payload['user_id']), db)
     
+    # Platform analytics
+    platform_analytics.record_expenses(recorded)
+    platform_analytics.record_activity(int(payload['user_id']))
+    
     return {"message": "Expense created successfully", "expense_id": str(new_expense.id)}
 
+def month_date_range(month, year: int):
+    month_int = int(month) if isinstance(month, str) else month
+    start_date = f"{year}-{month_int:02d}-01"
+    if month_int == 12:
+        end_date = f"{year + 1}-01-01"
+    else:
+        end_date = f"{year}-{month_int + 1:02d}-01"
+    return start_date, end_date
+
 @app.get("/api/expenses")
-def get_expenses(month: Optional[str] = None, year: Optional[int] = None, payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def get_expenses(month: Optional[str] = None, year: Optional[int] = None, payload: dict = Depends(verify_token), db: Session = Depends(get_read_db)):
     if payload['user_type'] != 'primary':
         raise HTTPException(status_code=403, detail="Unauthorized")
     
     query = db.query(Expense).filter(Expense.user_id == int(payload['user_id']))
     
     if month and year:
-        month_int = int(month) if isinstance(month, str) else month
-        start_date = f"{year}-{month_int:02d}-01"
-        if month_int == 12:
-            end_date = f"{year + 1}-01-01"
-        else:
-            end_date = f"{year}-{month_int + 1:02d}-01"
+        start_date, end_date = month_date_range(month, year)
         query = query.filter(Expense.date >= start_date, Expense.date < end_date)
     
     expenses = query.order_by(Expense.date.desc()).all()
@@ -424,8 +510,76 @@ def get_expenses(month: Optional[str] = None, year: Optional[int] = None, payloa
         "recurrence_months": exp.recurrence_months
     } for exp in expenses]
 
+# Bulk deletion - each runs as a single DELETE ... WHERE
+def log_bulk_delete(db: Session, user_id: int, action: str, item_id: str, deleted: int):
+    audit = AuditLog(
+        user_id=user_id,
+        action=action,
+        item_type="expense",
+        item_id=item_id,
+        details=f"Deleted {deleted} expenses: {item_id}"
+    )
+    db.add(audit)
+    db.commit()
+
+@app.delete("/api/expenses/series/{expense_id}")
+def delete_expense_series(expense_id: int, payload: dict = Depends(verify_token), db: Session = Depends(get_write_db)):
+    if payload['user_type'] != 'primary':
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    
+    user_id = int(payload['user_id'])
+    expense = db.query(Expense.id, Expense.parent_expense_id).filter(Expense.id == expense_id, Expense.user_id == user_id).first()
+    if not expense:
+        raise HTTPException(status_code=404, detail="Expense not found")
+    
+    # Accept any expense of the series, not only the first one
+    series_id = expense.parent_expense_id or expense.id
+    deleted = db.query(Expense).filter(
+        Expense.user_id == user_id,
+        or_(Expense.id == series_id, Expense.parent_expense_id == series_id)
+    ).delete(synchronize_session=False)
+    
+    log_bulk_delete(db, user_id, "delete_expense_series", str(series_id), deleted)
+    return {"message": "Expense series deleted successfully", "deleted": deleted}
+
+@app.delete("/api/expenses")
+def delete_expenses_by_month(month: int, year: int, payload: dict = Depends(verify_token), db: Session = Depends(get_write_db)):
+    if payload['user_type'] != 'primary':
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    
+    if not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="Invalid month")
+    
+    user_id = int(payload['user_id'])
+    start_date, end_date = month_date_range(month, year)
+    deleted = db.query(Expense).filter(
+        Expense.user_id == user_id,
+        Expense.date >= start_date,
+        Expense.date < end_date
+    ).delete(synchronize_session=False)
+    
+    log_bulk_delete(db, user_id, "delete_expenses_month", f"{year}-{month:02d}", deleted)
+    return {"message": "Expenses deleted successfully", "deleted": deleted}
+
+@app.post("/api/expenses/bulk-delete")
+def delete_expenses_by_ids(bulk: ExpenseBulkDelete, payload: dict = Depends(verify_token), db: Session = Depends(get_write_db)):
+    if payload['user_type'] != 'primary':
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    
+    if not bulk.ids:
+        raise HTTPException(status_code=400, detail="No expense ids given")
+    
+    user_id = int(payload['user_id'])
+    deleted = db.query(Expense).filter(
+        Expense.user_id == user_id,
+        Expense.id.in_(bulk.ids)
+    ).delete(synchronize_session=False)
+    
+    log_bulk_delete(db, user_id, "delete_expenses_bulk", ",".join(str(i) for i in bulk.ids)[:50], deleted)
+    return {"message": "Expenses deleted successfully", "deleted": deleted}
+
 @app.delete("/api/expenses/{expense_id}")
-def delete_expense(expense_id: int, payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def delete_expense(expense_id: int, payload: dict = Depends(verify_token), db: Session = Depends(get_write_db)):
     if payload['user_type'] != 'primary':
         raise HTTPException(status_code=403, detail="Unauthorized")
     
@@ -451,7 +605,7 @@ def delete_expense(expense_id: int, payload: dict = Depends(verify_token), db: S
 
 # Income
 @app.post("/api/income")
-def create_income(income: IncomeCreate, payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def create_income(income: IncomeCreate, payload: dict = Depends(verify_token), db: Session = Depends(get_write_db)):
     if payload['user_type'] != 'primary':
         raise HTTPException(status_code=403, detail="Unauthorized")
     
@@ -465,11 +619,12 @@ def create_income(income: IncomeCreate, payload: dict = Depends(verify_token), d
     
     db.add(new_income)
     db.commit()
+    platform_analytics.record_activity(int(payload['user_id']))
     
     return {"message": "Income created successfully", "income_id": str(new_income.id)}
 
 @app.get("/api/income")
-def get_income(payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def get_income(payload: dict = Depends(verify_token), db: Session = Depends(get_read_db)):
     if payload['user_type'] != 'primary':
         raise HTTPException(status_code=403, detail="Unauthorized")
     
@@ -485,7 +640,7 @@ def get_income(payload: dict = Depends(verify_token), db: Session = Depends(get_
 
 # Debts
 @app.post("/api/debts")
-def create_debt(debt: DebtCreate, payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def create_debt(debt: DebtCreate, payload: dict = Depends(verify_token), db: Session = Depends(get_write_db)):
     if payload['user_type'] != 'primary':
         raise HTTPException(status_code=403, detail="Unauthorized")
     
@@ -500,11 +655,12 @@ def create_debt(debt: DebtCreate, payload: dict = Depends(verify_token), db: Ses
     
     db.add(new_debt)
     db.commit()
+    platform_analytics.record_activity(int(payload['user_id']))
     
     return {"message": "Debt created successfully", "debt_id": str(new_debt.id)}
 
 @app.get("/api/debts")
-def get_debts(payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def get_debts(payload: dict = Depends(verify_token), db: Session = Depends(get_read_db)):
     if payload['user_type'] != 'primary':
         raise HTTPException(status_code=403, detail="Unauthorized")
     
@@ -521,7 +677,7 @@ def get_debts(payload: dict = Depends(verify_token), db: Session = Depends(get_d
 
 # Credit Cards
 @app.post("/api/credit-cards")
-def create_credit_card(card: CreditCardCreate, payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def create_credit_card(card: CreditCardCreate, payload: dict = Depends(verify_token), db: Session = Depends(get_write_db)):
     if payload['user_type'] != 'primary':
         raise HTTPException(status_code=403, detail="Unauthorized")
     
@@ -534,11 +690,12 @@ def create_credit_card(card: CreditCardCreate, payload: dict = Depends(verify_to
     
     db.add(new_card)
     db.commit()
+    platform_analytics.record_activity(int(payload['user_id']))
     
     return {"message": "Credit card created successfully", "card_id": str(new_card.id)}
 
 @app.get("/api/credit-cards")
-def get_credit_cards(payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def get_credit_cards(payload: dict = Depends(verify_token), db: Session = Depends(get_read_db)):
     if payload['user_type'] != 'primary':
         raise HTTPException(status_code=403, detail="Unauthorized")
     
@@ -553,33 +710,46 @@ def get_credit_cards(payload: dict = Depends(verify_token), db: Session = Depend
 
 # Audit Log
 @app.get("/api/audit-log")
-def get_audit_log(payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def get_audit_log(payload: dict = Depends(verify_token), db: Session = Depends(get_read_db)):
     if payload['user_type'] not in ['master', 'admin']:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
-    logs = db.query(AuditLog).order_by(AuditLog.timestamp.desc()).all()
-    return [{
-        "id": log.id,
-        "_id": str(log.id),
-        "user_id": log.user_id,
-        "action": log.action,
-        "item_type": log.item_type,
-        "item_id": log.item_id,
-        "details": log.details,
-        "timestamp": log.timestamp.isoformat()
-    } for log in logs]
+    # Each shard returns its entries newest first; merge them into one ordered list.
+    # Ids are only unique per shard, so with several shards "_id" is "<shard>:<id>".
+    def shard_logs(shard_id: int, shard_db: Session):
+        logs = shard_db.query(AuditLog).order_by(AuditLog.timestamp.desc()).all()
+        return [{
+            "id": log.id,
+            "_id": f"{shard_id}:{log.id}" if len(shard_engines) > 1 else str(log.id),
+            "user_id": log.user_id,
+            "action": log.action,
+            "item_type": log.item_type,
+            "item_id": log.item_id,
+            "details": log.details,
+            "timestamp": log.timestamp.isoformat()
+        } for log in logs]
+    
+    return list(heapq.merge(*fan_out(shard_logs, shard0_db=db), key=lambda log: log["timestamp"], reverse=True))
 
 @app.delete("/api/audit-log/{log_id}")
-def delete_audit_log(log_id: int, payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def delete_audit_log(log_id: str, payload: dict = Depends(verify_token), db: Session = Depends(get_write_db)):
     if payload['user_type'] not in ['master', 'admin']:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
-    log = db.query(AuditLog).filter(AuditLog.id == log_id).first()
-    if not log:
+    # Accepts "<shard>:<id>" as returned by get_audit_log, or a plain id on shard 0
+    shard_part, _, id_part = log_id.rpartition(":")
+    try:
+        shard_id, entry_id = int(shard_part or 0), int(id_part)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Log not found")
+    if not 0 <= shard_id < len(shard_engines):
         raise HTTPException(status_code=404, detail="Log not found")
     
-    db.delete(log)
-    db.commit()
+    with shard_session(shard_id) as shard_db:
+        deleted = shard_db.query(AuditLog).filter(AuditLog.id == entry_id).delete(synchronize_session=False)
+        shard_db.commit()
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Log not found")
     
     return {"message": "Log deleted successfully"}
 
@@ -615,7 +785,7 @@ def update_gamification(user_id: int, db: Session):
     db.commit()
 
 @app.get("/api/gamification")
-def get_gamification(payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def get_gamification(payload: dict = Depends(verify_token), db: Session = Depends(get_read_db)):
     if payload['user_type'] != 'primary':
         raise HTTPException(status_code=403, detail="Unauthorized")
     
@@ -630,7 +800,7 @@ def get_gamification(payload: dict = Depends(verify_token), db: Session = Depend
 
 # Statistics
 @app.get("/api/statistics")
-def get_statistics(payload: dict = Depends(verify_token), db: Session = Depends(get_db)):
+def get_statistics(payload: dict = Depends(verify_token), db: Session = Depends(get_read_db)):
     if payload['user_type'] != 'primary':
         raise HTTPException(status_code=403, detail="Unauthorized")
     
@@ -651,6 +821,26 @@ def get_statistics(payload: dict = Depends(verify_token), db: Session = Depends(
         "total_income": total_income
     }
 
+# Platform analytics, served from sketches instead of scanning expenses
+@app.get("/api/admin/analytics")
+def get_analytics(days: int = 30, payload: dict = Depends(verify_token)):
+    if payload['user_type'] not in ['master', 'admin']:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    
+    if not 1 <= days <= ANALYTICS_RETENTION_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {ANALYTICS_RETENTION_DAYS}")
+    
+    return platform_analytics.report(days)
+
+# Load shedding per route class (innermost, so CORS, compression and idempotent replays wrap it)
+app.add_middleware(AdmissionControlMiddleware)
+
+# Retried POSTs with the same Idempotency-Key get the stored response (outside admission control so replays are cheap)
+app.add_middleware(IdempotencyMiddleware, resolve_principal=principal_from_authorization)
+
+# Compress API payloads above the size threshold; static files are served from prebuilt variants
+app.add_middleware(ApiGZipMiddleware, minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', 1024)), compresslevel=6)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -668,6 +858,5 @@ logger = logging.getLogger(__name__)
 
 # Serve frontend HTML
 @app.get("/")
-async def serve_frontend():
-    from fastapi.responses import FileResponse
-    return FileResponse("static/index.html")
+async def serve_frontend(request: Request):
+    return frontend_index.response(request)
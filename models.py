@@ -18,11 +18,12 @@ class User(Base):
     notes = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
     
-    expenses = relationship("Expense", back_populates="user", cascade="all, delete-orphan")
-    incomes = relationship("Income", back_populates="user", cascade="all, delete-orphan")
-    debts = relationship("Debt", back_populates="user", cascade="all, delete-orphan")
-    credit_cards = relationship("CreditCard", back_populates="user", cascade="all, delete-orphan")
-    gamification = relationship("Gamification", back_populates="user", uselist=False, cascade="all, delete-orphan")
+    # Child rows are removed by ON DELETE CASCADE in the database, not loaded and deleted one by one
+    expenses = relationship("Expense", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    incomes = relationship("Income", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    debts = relationship("Debt", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    credit_cards = relationship("CreditCard", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    gamification = relationship("Gamification", back_populates="user", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
 
 class MasterUser(Base):
     __tablename__ = "master_users"
@@ -37,7 +38,7 @@ class Expense(Base):
     __tablename__ = "expenses"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     category = Column(String(50), nullable=False)
     location = Column(String(200))
     date = Column(String(20), nullable=False)
@@ -45,7 +46,7 @@ class Expense(Base):
     notes = Column(Text)
     is_recurring = Column(Boolean, default=False)
     recurrence_months = Column(Integer)
-    parent_expense_id = Column(Integer)
+    parent_expense_id = Column(Integer, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     user = relationship("User", back_populates="expenses")
@@ -54,7 +55,7 @@ class Income(Base):
     __tablename__ = "income"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     income_type = Column(String(50), nullable=False)
     amount = Column(Float, nullable=False)
     date = Column(String(20), nullable=False)
@@ -67,7 +68,7 @@ class Debt(Base):
     __tablename__ = "debts"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     description = Column(String(200), nullable=False)
     total_amount = Column(Float, nullable=False)
     installments = Column(Integer, nullable=False)
@@ -81,7 +82,7 @@ class CreditCard(Base):
     __tablename__ = "credit_cards"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     card_name = Column(String(100), nullable=False)
     closing_date = Column(Integer, nullable=False)
     due_date = Column(Integer, nullable=False)
@@ -93,7 +94,7 @@ class Gamification(Base):
     __tablename__ = "gamification"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), unique=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), unique=True, nullable=False)
     points = Column(Integer, default=0)
     streak_days = Column(Integer, default=0)
     last_entry_date = Column(String(20))
@@ -110,3 +111,22 @@ class AuditLog(Base):
     item_id = Column(String(50))
     details = Column(Text)
     timestamp = Column(DateTime, default=datetime.utcnow)
+
+class ShardAssignment(Base):
+    """Shard directory, kept on shard 0: which shard holds each user's rows."""
+    __tablename__ = "shard_directory"
+    
+    id = Column(Integer, primary_key=True, index=True)  # user id, unique across all shards
+    username = Column(String(50), unique=True, nullable=False, index=True)
+    family_id = Column(String(100), index=True)
+    shard_id = Column(Integer, nullable=False, default=0)
+    moving = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class AnalyticsSketch(Base):
+    """Serialized platform analytics sketch (see analytics.py), kept on shard 0."""
+    __tablename__ = "analytics_sketches"
+    
+    key = Column(String(100), primary_key=True)
+    data = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
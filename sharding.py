@@ -0,0 +1,216 @@
+"""User sharding across several databases.
+
+Every user's rows (profile, expenses, income, debts, cards, gamification and
+their own audit entries) live on one shard. Shard 0 is DATABASE_URL and also
+holds the shard directory, master users and admin audit entries; extra shards
+come from SHARD_URLS. Without SHARD_URLS everything stays on shard 0.
+
+Move a user to another shard while the API keeps running:
+
+    python sharding.py move <user_id> <shard_id>
+"""
+import os
+import sys
+import time
+import zlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from sqlalchemy import func, insert, literal, select, text
+
+from database import SessionLocal, shard_engines
+from models import User, Expense, Income, Debt, CreditCard, Gamification, AuditLog, ShardAssignment
+
+# How long a process trusts its cached view of the directory
+DIRECTORY_CACHE_SECONDS = float(os.environ.get("SHARD_DIRECTORY_CACHE_SECONDS", "5"))
+# Audit actions recorded by admins; their user_id is a master user, not the user being moved
+ADMIN_AUDIT_ACTIONS = ["create_user", "delete_user"]
+
+_fan_out_pool = ThreadPoolExecutor(max_workers=max(2, len(shard_engines)), thread_name_prefix="shard")
+
+
+@contextmanager
+def shard_session(shard_id: int):
+    db = SessionLocal(bind=shard_engines[shard_id])
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def fan_out(query, shard0_db=None):
+    """Runs `query(shard_id, db)` on every shard in parallel and returns the results in shard order.
+
+    `shard0_db` lets the caller reuse its own (possibly replica-routed) session for shard 0.
+    """
+    def run(shard_id):
+        if shard_id == 0 and shard0_db is not None:
+            return query(shard_id, shard0_db)
+        with shard_session(shard_id) as db:
+            return query(shard_id, db)
+
+    return list(_fan_out_pool.map(run, range(len(shard_engines))))
+
+
+class ShardDirectory:
+    def __init__(self):
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def locate(self, user_id: int):
+        """Returns (shard_id, moving) for a user; unknown users live on shard 0."""
+        now = time.monotonic()
+        cached = self._cache.get(user_id)
+        if cached and cached[0] > now:
+            return cached[1], cached[2]
+
+        with shard_session(0) as db:
+            assignment = db.get(ShardAssignment, user_id)
+            location = (assignment.shard_id, bool(assignment.moving)) if assignment else (0, False)
+        with self._lock:
+            self._cache[user_id] = (now + DIRECTORY_CACHE_SECONDS, *location)
+        return location
+
+    def forget(self, user_id: int):
+        with self._lock:
+            self._cache.pop(user_id, None)
+
+    def find_username(self, db, username: str):
+        return db.query(ShardAssignment).filter(ShardAssignment.username == username).first()
+
+    def choose_shard(self, db, family_id: str = None) -> int:
+        # Keep a family together so family-wide queries stay on one shard
+        if family_id:
+            member = db.query(ShardAssignment.shard_id).filter(ShardAssignment.family_id == family_id).first()
+            if member:
+                return member.shard_id
+            return zlib.crc32(family_id.encode("utf-8")) % len(shard_engines)
+
+        counts = dict(db.query(ShardAssignment.shard_id, func.count(ShardAssignment.id)).group_by(ShardAssignment.shard_id).all())
+        return min(range(len(shard_engines)), key=lambda shard_id: counts.get(shard_id, 0))
+
+    def assign(self, db, username: str, family_id: str = None) -> ShardAssignment:
+        """Reserves a globally unique user id on a shard. The caller commits."""
+        assignment = ShardAssignment(username=username, family_id=family_id, shard_id=self.choose_shard(db, family_id))
+        db.add(assignment)
+        db.flush()
+        return assignment
+
+    def change_family(self, user_id: int, family_id: str = None):
+        """Records a user's new family. Raises ValueError if that family lives on another shard."""
+        with shard_session(0) as db:
+            assignment = db.get(ShardAssignment, user_id)
+            if not assignment or assignment.family_id == family_id:
+                return
+            if family_id:
+                member = db.query(ShardAssignment.shard_id).filter(
+                    ShardAssignment.family_id == family_id, ShardAssignment.id != user_id
+                ).first()
+                if member and member.shard_id != assignment.shard_id:
+                    raise ValueError(f"Family {family_id} lives on shard {member.shard_id}")
+            assignment.family_id = family_id
+            db.commit()
+
+    def backfill(self):
+        """Registers users created before sharding (all on shard 0) in the directory."""
+        with shard_session(0) as db:
+            known = select(ShardAssignment.id)
+            legacy = select(User.id, User.username, User.family_id, literal(0), literal(False)).where(User.id.notin_(known))
+            db.execute(insert(ShardAssignment).from_select(["id", "username", "family_id", "shard_id", "moving"], legacy))
+            if db.get_bind().dialect.name == "postgresql":
+                # Explicit ids do not advance the sequence
+                db.execute(text(
+                    "SELECT setval(pg_get_serial_sequence('shard_directory', 'id'), "
+                    "COALESCE((SELECT MAX(id) FROM shard_directory), 0) + 1, false)"
+                ))
+            db.commit()
+
+
+shard_directory = ShardDirectory()
+
+
+def copy_columns(row, exclude=("id",)):
+    return {column.key: getattr(row, column.key) for column in row.__table__.columns if column.key not in exclude}
+
+
+def copy_user_rows(user_id: int, source, target):
+    user = source.get(User, user_id)
+    if not user:
+        raise ValueError(f"User {user_id} not found on source shard")
+    target.add(User(**copy_columns(user, exclude=())))
+    target.flush()
+
+    # Expense ids are per shard, so recurring series are re-linked to the new parent ids
+    new_expense_ids = {}
+    expenses = source.query(Expense).filter(Expense.user_id == user_id).order_by(Expense.parent_expense_id.isnot(None), Expense.id).all()
+    for expense in expenses:
+        values = copy_columns(expense)
+        if expense.parent_expense_id is not None:
+            values["parent_expense_id"] = new_expense_ids.get(expense.parent_expense_id)
+        copy = Expense(**values)
+        target.add(copy)
+        target.flush()
+        new_expense_ids[expense.id] = copy.id
+
+    for model in (Income, Debt, CreditCard, Gamification):
+        for row in source.query(model).filter(model.user_id == user_id):
+            target.add(model(**copy_columns(row)))
+
+    audit_rows = source.query(AuditLog).filter(AuditLog.user_id == user_id, AuditLog.action.notin_(ADMIN_AUDIT_ACTIONS))
+    for row in audit_rows:
+        target.add(AuditLog(**copy_columns(row)))
+
+
+def set_assignment(user_id: int, **values):
+    with shard_session(0) as db:
+        db.query(ShardAssignment).filter(ShardAssignment.id == user_id).update(values)
+        db.commit()
+
+
+def move_user(user_id: int, target_shard: int, grace_seconds: float = DIRECTORY_CACHE_SECONDS * 2):
+    """Moves a user to another shard while the API keeps serving.
+
+    Writes for the user get 503 while the move runs; reads keep hitting the
+    old shard until the directory flips.
+    """
+    if not 0 <= target_shard < len(shard_engines):
+        raise ValueError(f"Shard {target_shard} does not exist")
+
+    with shard_session(0) as db:
+        assignment = db.get(ShardAssignment, user_id)
+        if not assignment:
+            raise ValueError(f"User {user_id} is not in the shard directory")
+        source_shard = assignment.shard_id
+    if source_shard == target_shard:
+        return
+
+    set_assignment(user_id, moving=True)
+    # Let every process see the flag and in-flight writes finish
+    time.sleep(grace_seconds)
+
+    try:
+        with shard_session(source_shard) as source, shard_session(target_shard) as target:
+            copy_user_rows(user_id, source, target)
+            target.commit()
+    except Exception:
+        set_assignment(user_id, moving=False)
+        raise
+
+    set_assignment(user_id, shard_id=target_shard, moving=False)
+    # Processes may still read from the old shard until their cached location expires
+    time.sleep(grace_seconds)
+
+    with shard_session(source_shard) as source:
+        source.query(AuditLog).filter(AuditLog.user_id == user_id, AuditLog.action.notin_(ADMIN_AUDIT_ACTIONS)).delete(synchronize_session=False)
+        source.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+        source.commit()
+    logging.info(f"[Shard] Moved user {user_id} from shard {source_shard} to shard {target_shard}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "move":
+        print("Usage: python sharding.py move <user_id> <shard_id>")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    move_user(int(sys.argv[2]), int(sys.argv[3]))
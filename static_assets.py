@@ -0,0 +1,155 @@
+import gzip
+import hashlib
+import json
+import os
+import mimetypes
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.responses import Response
+from fastapi.staticfiles import StaticFiles
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.datastructures import Headers
+
+# Sources live in static/; `python build_static.py` writes the production build to static_build/
+STATIC_DIR = "static"
+STATIC_BUILD_DIR = "static_build"
+MANIFEST_NAME = "manifest.json"
+COMPRESSIBLE_SUFFIXES = {".html", ".css", ".js", ".mjs", ".json", ".svg", ".txt", ".map", ".xml", ".ico"}
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+# Preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def static_directory() -> str:
+    return STATIC_BUILD_DIR if os.path.isdir(STATIC_BUILD_DIR) else STATIC_DIR
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def load_fingerprinted_names(directory: str) -> set:
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as manifest:
+            return set(json.load(manifest).values())
+    except FileNotFoundError:
+        return set()
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves prebuilt .br/.gz variants and long-lived cache headers.
+
+    Fingerprinted files (listed in the build manifest) never change under
+    the same name, so they are cached as immutable; anything else must be
+    revalidated with its ETag.
+    """
+
+    def __init__(self, directory: str, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.fingerprinted = load_fingerprinted_names(directory)
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        original_path = str(full_path)
+        accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        encoding = None
+        has_variants = False
+        if Path(original_path).suffix in COMPRESSIBLE_SUFFIXES:
+            for coding, suffix in ENCODINGS:
+                if not os.path.isfile(original_path + suffix):
+                    continue
+                has_variants = True
+                if encoding is None and coding in accepted:
+                    encoding = coding
+                    full_path, stat_result = original_path + suffix, os.stat(original_path + suffix)
+
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if encoding and response.status_code != 304:
+            response.headers["content-encoding"] = encoding
+            response.headers["content-type"] = mimetypes.guess_type(original_path)[0] or "application/octet-stream"
+        if has_variants:
+            response.headers["vary"] = "Accept-Encoding"
+
+        relative_path = os.path.relpath(original_path, self.directory).replace(os.sep, "/")
+        response.headers["cache-control"] = IMMUTABLE_CACHE if relative_path in self.fingerprinted else REVALIDATE_CACHE
+        return response
+
+
+class CachedIndex:
+    """index.html and its compressed variants held in memory, reloaded when the file changes.
+
+    Responses carry Content-Encoding, so GZipMiddleware leaves them alone.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = None
+        self.variants = {}
+        self.etag = None
+
+    def _load(self):
+        mtime = os.stat(self.path).st_mtime
+        if mtime == self.mtime:
+            return
+        content = Path(self.path).read_bytes()
+        variants = {None: content}
+        for coding, suffix in ENCODINGS:
+            if os.path.isfile(self.path + suffix):
+                variants[coding] = Path(self.path + suffix).read_bytes()
+        if "gzip" not in variants:
+            # No build yet: compress once here rather than on every request
+            variants["gzip"] = gzip.compress(content, compresslevel=9, mtime=0)
+        self.variants = variants
+        self.etag = hashlib.sha256(content).hexdigest()[:16]
+        self.mtime = mtime
+
+    def response(self, request: Request) -> Response:
+        try:
+            self._load()
+        except FileNotFoundError:
+            return Response(status_code=404)
+
+        accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = next((coding for coding, _ in ENCODINGS if coding in accepted and coding in self.variants), None)
+        # Each encoding is a different representation, so it gets its own ETag
+        etag = f'"{self.etag}-{encoding}"' if encoding else f'"{self.etag}"'
+        headers = {"Cache-Control": REVALIDATE_CACHE, "ETag": etag}
+        if len(self.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in [tag.strip() for tag in if_none_match.replace("W/", "").split(",")]:
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=self.variants[encoding], media_type="text/html", headers=headers)
+
+
+class ApiGZipMiddleware:
+    """GZipMiddleware limited to API payloads.
+
+    Static files and the index come with their own precompressed variants
+    and per-encoding ETags; recompressing them (or binary assets like
+    images) on every request would only waste CPU.
+    """
+
+    def __init__(self, app, prefix: str = "/api", **options):
+        self.app = app
+        self.prefix = prefix
+        self.gzip = GZipMiddleware(app, **options)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(self.prefix):
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
@@ -0,0 +1,128 @@
+import asyncio
+
+from admission import AdaptiveLimiter, AdmissionControlMiddleware
+
+
+def make_limiter(**overrides):
+    settings = dict(initial=1, min_limit=1, max_limit=10, target_latency=0.3, max_queue=1, queue_timeout=0.05)
+    settings.update(overrides)
+    return AdaptiveLimiter("test", **settings)
+
+
+def blocking_app(release: asyncio.Event):
+    async def app(scope, receive, send):
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+    return app
+
+
+async def call(app, path="/api/expenses", method="GET"):
+    scope = {"type": "http", "method": method, "path": path, "headers": []}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    start = messages[0]
+    return start["status"], dict(start["headers"])
+
+
+def test_full_queue_answers_429():
+    async def scenario():
+        limiter = make_limiter(queue_timeout=5)
+        release = asyncio.Event()
+        middleware = AdmissionControlMiddleware(blocking_app(release), {name: limiter for name in ("auth", "write", "heavy_read", "light_read")})
+        running = asyncio.ensure_future(call(middleware))
+        queued = asyncio.ensure_future(call(middleware))
+        await asyncio.sleep(0)
+        status, headers = await call(middleware)
+        release.set()
+        return status, headers, await running, await queued
+
+    status, headers, running, queued = asyncio.run(scenario())
+    assert status == 429
+    assert int(headers[b"retry-after"]) >= 1
+    assert running[0] == 200 and queued[0] == 200
+
+
+def test_queue_timeout_answers_503_with_retry_after():
+    async def scenario():
+        limiter = make_limiter()
+        release = asyncio.Event()
+        middleware = AdmissionControlMiddleware(blocking_app(release), {name: limiter for name in ("auth", "write", "heavy_read", "light_read")})
+        running = asyncio.ensure_future(call(middleware))
+        await asyncio.sleep(0)
+        status, headers = await call(middleware)
+        release.set()
+        await running
+        return status, headers, limiter
+
+    status, headers, limiter = asyncio.run(scenario())
+    assert status == 503
+    assert int(headers[b"retry-after"]) >= 1
+    assert limiter.in_flight == 0 and not limiter.waiters
+
+
+def test_waiter_giving_up_as_it_is_admitted_hands_the_slot_on():
+    async def scenario():
+        limiter = make_limiter(max_queue=2, queue_timeout=5)
+        assert await limiter.acquire()
+        loop = asyncio.get_running_loop()
+        first, second = loop.create_future(), loop.create_future()
+        limiter.waiters.extend([first, second])
+
+        # The slot goes to the first waiter, which times out before it can run.
+        # A slow release keeps the limit at 1 so only one waiter is woken.
+        limiter.release(1.0)
+        assert first.done() and limiter.in_flight == 1
+        limiter._abandon(first)
+        return limiter, second
+
+    limiter, second = asyncio.run(scenario())
+    assert second.done() and second.result() is True
+    assert limiter.in_flight == 1
+    assert not limiter.waiters
+
+
+def test_limit_grows_only_when_saturated():
+    async def scenario():
+        limiter = make_limiter(initial=10, max_limit=20)
+        for _ in range(50):
+            assert await limiter.acquire()
+            limiter.release(0.01)
+        idle_limit = limiter.limit
+
+        for _ in range(10):
+            assert await limiter.acquire()
+        for _ in range(10):
+            limiter.release(0.01)
+        return idle_limit, limiter.limit
+
+    idle_limit, saturated_limit = asyncio.run(scenario())
+    assert idle_limit == 10
+    assert saturated_limit > 10
+
+
+def test_at_most_one_decrease_per_latency_window():
+    async def scenario():
+        limiter = make_limiter(initial=10, min_limit=1)
+        for _ in range(5):
+            assert await limiter.acquire()
+        for _ in range(5):
+            limiter.release(1.0)
+        after_burst = limiter.limit
+
+        # Once a window has passed the next slow request backs off again
+        limiter._last_decrease -= 10
+        assert await limiter.acquire()
+        limiter.release(1.0)
+        return after_burst, limiter.limit
+
+    after_burst, after_window = asyncio.run(scenario())
+    assert after_burst == 9.0
+    assert after_window == 9.0 * 0.9
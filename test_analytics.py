@@ -0,0 +1,123 @@
+import random
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from analytics import (
+    ANALYTICS_FLUSH_SECONDS, ANALYTICS_RETENTION_DAYS, DAILY_SPEND_PREFIX, DAU_PREFIX, HyperLogLog, PlatformAnalytics, TDigest
+)
+from models import AnalyticsSketch
+
+
+def make_analytics(tmp_path, analytics_class=PlatformAnalytics):
+    engine = create_engine(f"sqlite:///{tmp_path / 'analytics.db'}")
+    AnalyticsSketch.__table__.create(engine)
+    return analytics_class(sessionmaker(bind=engine))
+
+
+def test_hyperloglog_count_within_error_bound():
+    sketch = HyperLogLog()
+    for value in range(50000):
+        sketch.add(value)
+    # Standard error is 1.04 / sqrt(4096), about 1.6%; allow three of them
+    assert abs(sketch.count() - 50000) <= 50000 * 0.05
+
+
+def test_hyperloglog_merge_is_union():
+    first, second = HyperLogLog(), HyperLogLog()
+    for value in range(0, 30000):
+        first.add(value)
+    for value in range(20000, 50000):
+        second.add(value)
+    first.merge(second)
+    assert abs(first.count() - 50000) <= 50000 * 0.05
+
+
+def test_hyperloglog_small_counts_are_exact_enough():
+    sketch = HyperLogLog()
+    for value in range(100):
+        sketch.add(value)
+        sketch.add(value)
+    assert abs(sketch.count() - 100) <= 2
+
+
+def test_tdigest_quantiles_of_uniform_distribution():
+    digest = TDigest()
+    values = list(range(1, 100001))
+    random.Random(7).shuffle(values)
+    for value in values:
+        digest.add(value)
+    for q in (0.01, 0.25, 0.5, 0.75, 0.9, 0.99):
+        assert abs(digest.quantile(q) - q * 100000) <= 100000 * 0.01
+    assert digest.min == 1 and digest.max == 100000
+
+
+def test_tdigest_merged_quantiles_match_single_digest():
+    rng = random.Random(11)
+    values = sorted(rng.lognormvariate(3, 1) for _ in range(40000))
+    parts = [TDigest() for _ in range(4)]
+    for index, value in enumerate(values):
+        parts[index % 4].add(value)
+    merged = TDigest()
+    for part in parts:
+        merged.merge(TDigest.from_dict(part.to_dict()))
+    assert merged.total_weight == len(values)
+    for q in (0.5, 0.9, 0.99):
+        exact = values[int(q * len(values))]
+        assert abs(merged.quantile(q) - exact) <= exact * 0.05
+
+
+def test_daily_spend_uses_per_day_keys_and_expires(tmp_path):
+    analytics = make_analytics(tmp_path)
+    today = date.today()
+    expired = (today - timedelta(days=ANALYTICS_RETENTION_DAYS + 1)).isoformat()
+    analytics.record_expenses([("food", today.isoformat(), 10.0), ("food", today.isoformat(), 5.0), ("rent", expired, 100.0)])
+    analytics.record_activity(1, today - timedelta(days=ANALYTICS_RETENTION_DAYS + 1))
+    analytics.flush()
+
+    keys = set(analytics.persisted)
+    assert DAILY_SPEND_PREFIX + today.isoformat() in keys
+    assert DAILY_SPEND_PREFIX + expired not in keys
+    assert not any(key.startswith(DAU_PREFIX) for key in keys)
+    report = analytics.report(days=1)
+    assert report["daily_spend"] == [{"date": today.isoformat(), "total": 15.0, "count": 2}]
+
+
+def test_flushing_sketches_stay_visible_until_refreshed(tmp_path):
+    seen_during_refresh = []
+
+    class ObservedAnalytics(PlatformAnalytics):
+        def _read_persisted(self):
+            if self.persisted is not None:
+                seen_during_refresh.append(self.report(days=1)["active_users_in_period"])
+            return super()._read_persisted()
+
+    analytics = make_analytics(tmp_path, ObservedAnalytics)
+    analytics.refresh()
+    analytics.record_activity(1)
+    analytics.record_activity(2)
+    analytics.flush()
+
+    assert seen_during_refresh == [2]
+    assert analytics.flushing == {}
+    assert analytics.report(days=1)["active_users_in_period"] == 2
+
+
+def test_report_only_worker_sees_other_workers_flushes(tmp_path):
+    writer = make_analytics(tmp_path)
+    reader = PlatformAnalytics(writer.session_factory)
+    assert reader.report(days=1)["active_users_in_period"] == 0
+    assert reader._flusher is not None
+
+    writer.record_activity(1)
+    writer.flush()
+    # A flusher tick with nothing pending still reloads the stored rows
+    reader.flush()
+    assert reader.report(days=1)["active_users_in_period"] == 1
+
+    writer.record_activity(2)
+    writer.flush()
+    # A view older than a flush interval is reloaded on read
+    reader.updated_at -= timedelta(seconds=ANALYTICS_FLUSH_SECONDS + 1)
+    assert reader.report(days=1)["active_users_in_period"] == 2
@@ -0,0 +1,119 @@
+import asyncio
+import json
+
+from idempotency import IdempotencyMiddleware, IdempotencyStore
+
+
+class CountingApp:
+    """Answers each POST with the number of times it ran; `statuses` overrides the status per call."""
+
+    def __init__(self, statuses=(), release: asyncio.Event = None):
+        self.calls = 0
+        self.statuses = list(statuses)
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+        call = self.calls
+        message = await receive()
+        if self.release is not None:
+            await self.release.wait()
+        status = self.statuses.pop(0) if self.statuses else 201
+        body = json.dumps({"call": call, "echo": message["body"].decode()}).encode()
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def make_middleware(app):
+    return IdempotencyMiddleware(app, lambda authorization: authorization or None, IdempotencyStore())
+
+
+async def post(app, body=b'{"amount": 10}', key=b"key-1", token=b"user-1"):
+    headers = [(b"authorization", token), (b"idempotency-key", key)]
+    scope = {"type": "http", "method": "POST", "path": "/api/expenses", "headers": headers}
+    sent = False
+    messages = []
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            await asyncio.Event().wait()
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    start = messages[0]
+    return start["status"], dict(start["headers"]), b"".join(message.get("body", b"") for message in messages[1:])
+
+
+def test_replay_returns_stored_response():
+    async def scenario():
+        app = CountingApp()
+        middleware = make_middleware(app)
+        return app, await post(middleware), await post(middleware)
+
+    app, first, second = asyncio.run(scenario())
+    assert app.calls == 1
+    assert first[0] == second[0] == 201
+    assert second[2] == first[2]
+    assert second[1][b"idempotent-replayed"] == b"true"
+    assert b"idempotent-replayed" not in first[1]
+
+
+def test_concurrent_duplicate_waits_for_the_original():
+    async def scenario():
+        release = asyncio.Event()
+        app = CountingApp(release=release)
+        middleware = make_middleware(app)
+        original = asyncio.ensure_future(post(middleware))
+        duplicate = asyncio.ensure_future(post(middleware))
+        await asyncio.sleep(0.01)
+        assert not duplicate.done()
+        release.set()
+        return app, await original, await duplicate
+
+    app, original, duplicate = asyncio.run(scenario())
+    assert app.calls == 1
+    assert duplicate[2] == original[2]
+    assert duplicate[1][b"idempotent-replayed"] == b"true"
+
+
+def test_key_reused_with_different_body_is_rejected():
+    async def scenario():
+        app = CountingApp()
+        middleware = make_middleware(app)
+        await post(middleware)
+        return app, await post(middleware, body=b'{"amount": 20}')
+
+    app, response = asyncio.run(scenario())
+    assert response[0] == 422
+    assert app.calls == 1
+
+
+def test_keys_are_scoped_per_principal():
+    async def scenario():
+        app = CountingApp()
+        middleware = make_middleware(app)
+        await post(middleware, token=b"user-1")
+        return app, await post(middleware, token=b"user-2")
+
+    app, response = asyncio.run(scenario())
+    assert app.calls == 2
+    assert b"idempotent-replayed" not in response[1]
+
+
+def test_server_errors_and_shed_requests_are_not_stored():
+    for status in (500, 503, 429):
+        async def scenario():
+            app = CountingApp(statuses=[status])
+            middleware = make_middleware(app)
+            return app, await post(middleware), await post(middleware)
+
+        app, failed, retried = asyncio.run(scenario())
+        assert failed[0] == status
+        assert retried[0] == 201
+        assert app.calls == 2
+        assert b"idempotent-replayed" not in retried[1]
@@ -0,0 +1,61 @@
+import json
+import os
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from build_static import build
+from static_assets import (
+    IMMUTABLE_CACHE, MANIFEST_NAME, REVALIDATE_CACHE, ApiGZipMiddleware, PrecompressedStaticFiles
+)
+
+
+def make_client(tmp_path):
+    source, target = tmp_path / "static", tmp_path / "static_build"
+    source.mkdir()
+    (source / "logo.png").write_bytes(os.urandom(4096))
+    (source / "app.js").write_text("console.log('escala');\n" * 200)
+    (source / "index.html").write_text('<script src="/static/app.js"></script>')
+    build(source, target)
+
+    app = FastAPI()
+
+    @app.get("/api/items")
+    def items():
+        return [{"name": "item", "index": index} for index in range(200)]
+
+    app.mount("/static", PrecompressedStaticFiles(directory=str(target)), name="static")
+    app.add_middleware(ApiGZipMiddleware, minimum_size=1024)
+    manifest = json.loads((target / MANIFEST_NAME).read_text())
+    return TestClient(app), manifest
+
+
+def test_fingerprinted_png_is_not_compressed(tmp_path):
+    client, manifest = make_client(tmp_path)
+    response = client.get("/static/" + manifest["logo.png"], headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE
+
+
+def test_fingerprinted_script_uses_prebuilt_variant(tmp_path):
+    client, manifest = make_client(tmp_path)
+    response = client.get("/static/" + manifest["app.js"], headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.text.startswith("console.log")
+
+
+def test_original_names_are_kept_and_revalidated(tmp_path):
+    client, _ = make_client(tmp_path)
+    for name in ("logo.png", "app.js"):
+        response = client.get("/static/" + name, headers={"Accept-Encoding": "identity"})
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == REVALIDATE_CACHE
+
+
+def test_api_payloads_are_compressed(tmp_path):
+    client, _ = make_client(tmp_path)
+    response = client.get("/api/items", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.json()) == 200